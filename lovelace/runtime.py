@@ -1,288 +1,763 @@
-from __future__ import annotations
-from dataclasses import dataclass
-import time
-import random
-import re
-from typing import Any, Dict, List, Tuple, Callable
-
-@dataclass
-class Function:
-    args: List[str]
-    expr: str | None = None
-    body: List[str] | None = None  # lines inside fn ... end
-
-class LovelaceInterpreter:
-    def __init__(self, output_fn=print):
-        self.vars: Dict[str, Any] = {}
-        self.mem: Dict[int, Any] = {}
-        self.funcs: Dict[str, Function] = {}
-        self.output = output_fn
-        self.__apps = ["chrome","edge","firefox","safari","opera","notepad","calc","vscode","terminal"]
-
-    # ------------- Public API -------------
-    def run_string(self, src: str):
-        lines = self._preprocess(src)
-        self._exec_block(lines, 0, len(lines))
-
-    def run_file(self, path: str):
-        with open(path, "r", encoding="utf-8") as f:
-            self.run_string(f.read())
-
-    # ------------- Core executor -------------
-    def _preprocess(self, src: str) -> List[str]:
-        out = []
-        for raw in src.replace("\r\n","\n").replace("\r","\n").split("\n"):
-            # strip comments
-            line = re.sub(r"###.*$", "", raw).rstrip()
-            if line.strip():
-                out.append(line)
-        return out
-
-    def _exec_block(self, lines: List[str], start: int, end: int) -> int:
-        i = start
-        while i < end:
-            line = lines[i].strip()
-            if line == "end":
-                return i + 1
-
-            # var NAME (expr)
-            m = re.match(r"^var\s+([A-Za-z_]\w*)\s*\((.+)\)\s*$", line)
-            if m:
-                name, expr = m.groups()
-                self.vars[name] = self._eval(expr)
-                i += 1
-                continue
-
-            # mem[idx] = expr
-            m = re.match(r"^mem\[(.+?)\]\s*=\s*(.+)$", line)
-            if m:
-                idx_expr, rhs = m.groups()
-                idx_val = int(self._eval(idx_expr))
-                self.mem[idx_val] = self._eval(rhs)
-                i += 1
-                continue
-
-            # out expr
-            m = re.match(r"^out\s+(.+)$", line)
-            if m:
-                self.output(self._eval(m.group(1)))
-                i += 1
-                continue
-
-            # sleep(seconds)
-            m = re.match(r"^sleep\((.+)\)\s*$", line)
-            if m:
-                secs = float(self._eval(m.group(1)))
-                time.sleep(max(0.0, secs))
-                i += 1
-                continue
-
-            # spawn (count) (list|RAN)
-            m = re.match(r"^spawn\s*\((.+)\)\s*\((.+)\)\s*$", line)
-            if m:
-                count_expr, list_part = m.groups()
-                count = int(self._eval(count_expr))
-                if list_part.strip().upper() == "RAN":
-                    for _ in range(count):
-                        app = random.choice(self.__apps)
-                        self.output(f"[spawn] {app} (simulated)")
-                else:
-                    names = [s.strip() for s in list_part.split(",") if s.strip()]
-                    for _ in range(count):
-                        app = random.choice(names) if names else "unknown"
-                        self.output(f"[spawn] {app} (simulated)")
-                i += 1
-                continue
-
-            # if / elif / else
-            if re.match(r"^if\s*\(.+\):\s*$", line):
-                i = self._handle_if(lines, i, end)
-                continue
-            if re.match(r"^elif\s*\(.+\):\s*$", line) or line == "else:":
-                raise RuntimeError("‘elif/else’ without matching ‘if’")
-
-            # loop (N):
-            m = re.match(r"^loop\s*\((.+)\):\s*$", line)
-            if m:
-                i = self._handle_loop_count(lines, i, end, m.group(1))
-                continue
-            # loop arr:
-            m = re.match(r"^loop\s+([A-Za-z_]\w*):\s*$", line)
-            if m:
-                i = self._handle_loop_each(lines, i, end, m.group(1))
-                continue
-
-            # fn name(args) => expr
-            m = re.match(r"^fn\s+([A-Za-z_]\w*)\s*\(([^)]*)\)\s*=>\s*(.+)$", line)
-            if m:
-                name, arglist, expr = m.groups()
-                args = [a.strip() for a in arglist.split(",") if a.strip()]
-                self.funcs[name] = Function(args=args, expr=expr)
-                i += 1
-                continue
-
-            # fn name(args):
-            m = re.match(r"^fn\s+([A-Za-z_]\w*)\s*\(([^)]*)\):\s*$", line)
-            if m:
-                name, arglist = m.groups()
-                args = [a.strip() for a in arglist.split(",") if a.strip()]
-                body_start = i + 1
-                j = body_start
-                depth = 1
-                while j < end and depth > 0:
-                    t = lines[j].strip()
-                    if re.match(r"^fn\s+[A-Za-z_]\w*\s*\([^)]*\):\s*$", t) or re.match(r"^if\s*\(.+\):\s*$", t) or re.match(r"^loop\s*(\(|[A-Za-z_])", t):
-                        depth += 1
-                    elif t == "end":
-                        depth -= 1
-                    j += 1
-                body = lines[body_start:j-1]
-                self.funcs[name] = Function(args=args, body=body)
-                i = j
-                continue
-
-            # return expr outside fn
-            if re.match(r"^return\s+.+$", line):
-                raise RuntimeError("‘return’ used outside of a function")
-
-            # bare function calls
-            m = re.match(r"^([A-Za-z_]\w*)\(([^)]*)\)\s*$", line)
-            if m:
-                self._call_func(m.group(1), [a.strip() for a in m.group(2).split(",")] if m.group(2).strip() else [])
-                i += 1
-                continue
-
-            raise RuntimeError(f"Unrecognized syntax: {line}")
-        return i
-
-    # ------------- Helpers -------------
-    def _eval(self, expr: str) -> Any:
-        # First, check if this is a bare Lovelace function call
-        m = re.match(r"^([A-Za-z_]\w*)\((.*)\)$", expr.strip())
-        if m:
-            fn_name, arglist = m.groups()
-            args = [a.strip() for a in arglist.split(",")] if arglist.strip() else []
-            if fn_name in self.funcs:
-                return self._call_func(fn_name, args)
-
-        # Replace mem[i] reads
-        def mem_read(m):
-            idx = int(self._eval(m.group(1)))
-            return repr(self.mem.get(idx, 0))
-        expr_py = re.sub(r"mem\[(.+?)\]", mem_read, expr)
-
-        # Safe-ish eval environment
-        env = {
-            "str": str, "int": int, "float": float, "bool": bool, "num": float,
-            "RAN_int": lambda a,b: random.randint(int(a), int(b)),
-            "RAN_pick": lambda arr: random.choice(list(arr)),
-        }
-        env.update(self.vars)
-        try:
-            return eval(expr_py, {"__builtins__": {}}, env)
-        except Exception:
-            return expr.strip('"')
-
-    def _call_func(self, name: str, arg_exprs: List[str]) -> Any:
-        if name not in self.funcs:
-            raise RuntimeError(f"Unknown function: {name}")
-        fn = self.funcs[name]
-        args_vals = [self._eval(a) for a in arg_exprs]
-
-        if fn.expr is not None:
-            local = dict(zip(fn.args, args_vals))
-            env = dict(self.vars)
-            env.update(local)
-            expr = fn.expr
-            def mem_read(m):
-                idx = int(self._eval(m.group(1)))
-                return repr(self.mem.get(idx, 0))
-            expr_py = re.sub(r"mem\[(.+?)\]", mem_read, expr)
-            return eval(expr_py, {"__builtins__": {}}, env)
-
-        frame_vars_backup = dict(self.vars)
-        try:
-            for k, v in zip(fn.args, args_vals):
-                self.vars[k] = v
-            i = 0
-            while i < len(fn.body or []):
-                line = (fn.body or [])[i].strip()
-                if line.startswith("return "):
-                    return self._eval(line[len("return "):])
-                self._exec_block([line], 0, 1)
-                i += 1
-        finally:
-            self.vars = frame_vars_backup
-
-    def _handle_if(self, lines: List[str], i: int, end: int) -> int:
-        j = i + 1
-        depth = 1
-        blocks: List[Tuple[str | None, Tuple[int,int]]] = []
-        cur_start = j
-        headers = [(i, lines[i].strip())]
-
-        while j < end and depth > 0:
-            t = lines[j].strip()
-            if re.match(r"^if\s*\(.+\):\s*$", t) or re.match(r"^loop\s*(\(|[A-Za-z_])", t) or re.match(r"^fn\s+[A-Za-z_]\w*\s*\([^)]*\):\s*$", t):
-                depth += 1
-            elif t == "end":
-                depth -= 1
-                if depth == 0:
-                    headers.append((j, "end"))
-                    break
-            elif depth == 1 and (re.match(r"^elif\s*\(.+\):\s*$", t) or t == "else:"):
-                headers.append((j, t))
-            j += 1
-
-        for idx in range(len(headers)-1):
-            line_idx, hdr = headers[idx]
-            next_idx, _ = headers[idx+1]
-            start_block = line_idx + 1
-            end_block = next_idx
-            if hdr.startswith("if"):
-                cond = hdr[hdr.find("(")+1: hdr.rfind(")")]
-                blocks.append((cond, (start_block, end_block)))
-            elif hdr.startswith("elif"):
-                cond = hdr[hdr.find("(")+1: hdr.rfind(")")]
-                blocks.append((cond, (start_block, end_block)))
-            elif hdr.startswith("else"):
-                blocks.append((None, (start_block, end_block)))
-
-        for cond, (bs, be) in blocks:
-            if cond is None or bool(self._eval(cond)):
-                self._exec_block(lines, bs, be)
-                break
-
-        return headers[-1][0] + 1
-
-    def _handle_loop_count(self, lines: List[str], i: int, end: int, count_expr: str) -> int:
-        j = i + 1
-        depth = 1
-        while j < end and depth > 0:
-            t = lines[j].strip()
-            if re.match(r"^if\s*\(.+\):\s*$", t) or re.match(r"^loop\s*(\(|[A-Za-z_])", t) or re.match(r"^fn\s+[A-Za-z_]\w*\s*\([^)]*\):\s*$", t):
-                depth += 1
-            elif t == "end":
-                depth -= 1
-            j += 1
-        count = int(self._eval(count_expr))
-        for _ in range(count):
-            self._exec_block(lines, i+1, j-1)
-        return j
-
-    def _handle_loop_each(self, lines: List[str], i: int, end: int, arr_name: str) -> int:
-        j = i + 1
-        depth = 1
-        while j < end and depth > 0:
-            t = lines[j].strip()
-            if re.match(r"^if\s*\(.+\):\s*$", t) or re.match(r"^loop\s*(\(|[A-Za-z_])", t) or re.match(r"^fn\s+[A-Za-z_]\w*\s*\([^)]*\):\s*$", t):
-                depth += 1
-            elif t == "end":
-                depth -= 1
-            j += 1
-        arr = self.vars.get(arr_name, [])
-        for item in list(arr):
-            self.vars["item"] = item
-            self._exec_block(lines, i+1, j-1)
-        self.vars.pop("item", None)
-        return j
+from __future__ import annotations
+import ast
+from collections import ChainMap
+from dataclasses import dataclass
+from functools import lru_cache
+import time
+import random
+import re
+from typing import Any, ClassVar, Dict, List, Tuple, Callable
+
+# Precompiled patterns — compiling once at import keeps the hot dispatch
+# loops free of re's per-call cache lookups.
+_RE_COMMENT = re.compile(r"###[^\n]*")
+_RE_VAR = re.compile(r"^var\s+([A-Za-z_]\w*)\s*\((.+)\)\s*$")
+_RE_MEM = re.compile(r"^mem\[(.+?)\]\s*=\s*(.+)$")
+# The alternation consumes quoted spans whole, so a literal "mem[0]"
+# inside a string never matches group 1 and is left untouched.
+_RE_MEM_READ = re.compile(r"\"[^\"]*\"|'[^']*'|mem\[(.+?)\]")
+_RE_SLEEP = re.compile(r"^sleep\((.+)\)\s*$")
+_RE_SPAWN = re.compile(r"^spawn\s*\((.+)\)\s*\((.+)\)\s*$")
+_RE_IF = re.compile(r"^if\s*\(.+\):\s*$")
+_RE_ELIF = re.compile(r"^elif\s*\(.+\):\s*$")
+_RE_LOOP_N = re.compile(r"^loop\s*\((.+)\):\s*$")
+_RE_LOOP_EACH = re.compile(r"^loop\s+([A-Za-z_]\w*):\s*$")
+_RE_FN_EXPR = re.compile(r"^fn\s+([A-Za-z_]\w*)\s*\(([^)]*)\)\s*=>\s*(.+)$")
+_RE_FN_BLOCK = re.compile(r"^fn\s+([A-Za-z_]\w*)\s*\(([^)]*)\):\s*$")
+_RE_CALL = re.compile(r"^([A-Za-z_]\w*)\(([^)]*)\)\s*$")
+_RE_CALL_EXPR = re.compile(r"^([A-Za-z_]\w*)\((.*)\)$")
+# One alternation covering every block opener, so depth scanners cost a
+# single match per line instead of three.
+_RE_BLOCK_OPENER = re.compile(
+    r"^(?:if\s*\(.+\):|loop\s*(?:\(.+\):|[A-Za-z_]\w*:)|fn\s+[A-Za-z_]\w*\s*\([^)]*\):)\s*$"
+)
+# Subset of expressions the numeric-loop JIT accepts: mem[<int literal>]
+# references plus bare arithmetic.
+_RE_MEM_INT = re.compile(r"mem\[(\d+)\]")
+_RE_NUMERIC_EXPR = re.compile(r"^[\d\s.+\-*/%()]*$")
+# Stricter subset the int64 lane accepts once mem refs are removed:
+# additive literal arithmetic only, so per-iteration growth is bounded.
+_RE_INT_LANE_RHS = re.compile(r"^[\d\s+\-()]*$")
+
+@lru_cache(maxsize=1024)
+def _compile_expr(src: str):
+    """Compile an expression string once; hot loops re-eval only bytecode."""
+    return compile(src, "<lovelace-expr>", "eval")
+
+# Sentinel for "expression is not a literal"; None is a valid folded value.
+_NOT_CONST = object()
+
+def _fold_const(expr: str) -> Any:
+    """Pre-evaluate a pure literal expression at parse time.
+
+    Returns the Python value for string/number/bool literals so dispatch can
+    skip the eval machinery entirely, or _NOT_CONST for anything else.
+    """
+    try:
+        node = ast.parse(expr, mode="eval")
+    except SyntaxError:
+        return _NOT_CONST
+    if isinstance(node.body, ast.Constant):
+        return node.body.value
+    return _NOT_CONST
+
+@lru_cache(maxsize=1024)
+def _inline_mem_reads(expr: str) -> str:
+    """Rewrite code-position mem[X] reads as __mem(X) calls for evaluation.
+
+    Memoized so each distinct expression pays the substitution once;
+    evaluation then does a direct cell access instead of a per-eval regex
+    substitution that re-enters the interpreter for the index. String
+    literals pass through unchanged, and ops keep the user's source text,
+    so neither output nor error fallbacks nor the numeric-loop JIT ever
+    see the __mem spelling.
+    """
+    if "mem[" not in expr:
+        return expr
+    return _RE_MEM_READ.sub(
+        lambda m: m.group(0) if m.group(1) is None else f"__mem({m.group(1)})",
+        expr)
+
+@dataclass
+class Function:
+    args: Tuple[str, ...]
+    expr: str | None = None
+    body: List[Op] | None = None  # parsed ops inside fn ... end
+
+class _ReturnSignal(Exception):
+    """Unwinds a block-form function body when `return` executes."""
+    def __init__(self, value: Any):
+        self.value = value
+
+# ------------- Parsed program representation -------------
+# Scripts are parsed once into a tree of Op nodes; execution walks the
+# ops instead of re-matching raw lines, so a `loop (N):` body costs one
+# parse no matter how many iterations run.
+
+class Op:
+    # Index into the interpreter's handler table; see _handlers in __init__.
+    code: ClassVar[int] = -1
+
+(OP_VAR, OP_MEM_SET, OP_OUT, OP_SLEEP, OP_SPAWN, OP_IF,
+ OP_LOOP_COUNT, OP_LOOP_EACH, OP_FN_EXPR, OP_FN_BLOCK, OP_CALL,
+ OP_RETURN) = range(12)
+
+@dataclass
+class VarOp(Op):
+    code: ClassVar[int] = OP_VAR
+    name: str
+    expr: str
+    const: Any = _NOT_CONST
+
+@dataclass
+class MemSetOp(Op):
+    code: ClassVar[int] = OP_MEM_SET
+    idx_expr: str
+    rhs_expr: str
+    idx_const: Any = _NOT_CONST
+    rhs_const: Any = _NOT_CONST
+
+@dataclass
+class OutOp(Op):
+    code: ClassVar[int] = OP_OUT
+    expr: str
+    const: Any = _NOT_CONST
+
+@dataclass
+class SleepOp(Op):
+    code: ClassVar[int] = OP_SLEEP
+    expr: str
+    const: Any = _NOT_CONST
+
+@dataclass
+class SpawnOp(Op):
+    code: ClassVar[int] = OP_SPAWN
+    count_expr: str
+    names: Tuple[str, ...] | None  # None means RAN (pick from built-ins)
+
+@dataclass
+class IfOp(Op):
+    code: ClassVar[int] = OP_IF
+    # (condition, body) pairs in source order; condition None means else.
+    branches: List[Tuple[str | None, List[Op]]]
+
+@dataclass
+class LoopCountOp(Op):
+    code: ClassVar[int] = OP_LOOP_COUNT
+    count_expr: str
+    body: List[Op]
+
+@dataclass
+class LoopEachOp(Op):
+    code: ClassVar[int] = OP_LOOP_EACH
+    arr_name: str
+    body: List[Op]
+    # True when the body may rebind the array, forcing iteration over a
+    # snapshot; decided once at parse time.
+    needs_copy: bool = False
+
+@dataclass
+class FnExprOp(Op):
+    code: ClassVar[int] = OP_FN_EXPR
+    name: str
+    args: Tuple[str, ...]
+    expr: str
+
+@dataclass
+class FnBlockOp(Op):
+    code: ClassVar[int] = OP_FN_BLOCK
+    name: str
+    args: Tuple[str, ...]
+    body: List[Op]  # parsed once at definition, executed directly on call
+
+@dataclass
+class CallOp(Op):
+    code: ClassVar[int] = OP_CALL
+    name: str
+    arg_exprs: Tuple[str, ...]
+
+@dataclass
+class ReturnOp(Op):
+    code: ClassVar[int] = OP_RETURN
+    expr: str
+
+class LovelaceInterpreter:
+    def __init__(self, output_fn=print):
+        self.vars: Dict[str, Any] = {}
+        # Dense cells live in a contiguous list (O(1) indexed access, cache
+        # friendly for sequential scans); sparse or negative indices fall
+        # back to a dict.
+        self._mem_list: List[Any] = []
+        self._mem_sparse: Dict[int, Any] = {}
+        self.funcs: Dict[str, Function] = {}
+        # Function-call locals; writes target the innermost frame so a call
+        # costs O(|args|) instead of copying the whole var table.
+        self._scopes: List[Dict[str, Any]] = []
+        # One reusable ChainMap per frame, built at call entry; every _eval
+        # inside the frame shares it instead of allocating its own mapping.
+        self._scope_envs: List[ChainMap] = []
+        self.output = output_fn
+        self.__apps = ["chrome","edge","firefox","safari","opera","notepad","calc","vscode","terminal"]
+        self._rng = random.Random()
+        # Safe-ish eval environment, built once; per-eval lookups chain
+        # through this as globals instead of rebuilding a dict per call.
+        self._eval_globals: Dict[str, Any] = {
+            "__builtins__": {},
+            "str": str, "int": int, "float": float, "bool": bool, "num": float,
+            "RAN_int": lambda a,b: random.randint(int(a), int(b)),
+            "RAN_pick": lambda arr: random.choice(list(arr)),
+            "__mem": self._mem_get,
+        }
+        self._program_cache: Dict[str, List[Op]] = {}
+        # Memoized single-line ops: identical statement lines (common in
+        # generated or copy-pasted scripts) parse once and share their Op.
+        self._line_cache: Dict[Tuple[str, bool], Op] = {}
+        self._jit_cache: Dict[str, Any] = {}  # kernel source -> compiled fn (False = gave up)
+        # Handler table indexed by Op.code; dispatch is one indexed load and
+        # a call instead of an isinstance cascade.
+        self._handlers: Tuple[Callable[[Op], None], ...] = (
+            self._op_var, self._op_mem_set, self._op_out, self._op_sleep,
+            self._handle_spawn, self._handle_if, self._handle_loop_count,
+            self._handle_loop_each, self._op_fn_expr, self._op_fn_block,
+            self._op_call, self._op_return,
+        )
+        self._np = None  # numpy module once the JIT path has imported it
+
+    # ------------- Public API -------------
+    def run_string(self, src: str):
+        program = self._program_cache.get(src)
+        if program is None:
+            program = self._parse(self._preprocess(src))
+            self._program_cache[src] = program
+        self._exec_block(program)
+
+    def run_file(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            self.run_string(f.read())
+
+    # ------------- Parser -------------
+    def _preprocess(self, src: str) -> List[str]:
+        # One comment-stripping pass over the whole source instead of a
+        # regex invocation per line.
+        src = src.replace("\r\n","\n").replace("\r","\n")
+        src = _RE_COMMENT.sub("", src)
+        return [line.rstrip() for line in src.split("\n") if line.strip()]
+
+    def _parse(self, lines: List[str]) -> List[Op]:
+        ops, _ = self._parse_block(lines, 0, len(lines), self._match_ends(lines))
+        return ops
+
+    @staticmethod
+    def _match_ends(lines: List[str]) -> Dict[int, int]:
+        """Map every block-opener line index to its matching `end` index.
+
+        One left-to-right pass with a stack; block extents then cost O(1) to
+        look up instead of a forward rescan per opener.
+        """
+        ends: Dict[int, int] = {}
+        stack: List[int] = []
+        for i, raw in enumerate(lines):
+            t = raw.strip()
+            if (t.endswith(":")
+                    and (t.startswith("if") or t.startswith("loop") or t.startswith("fn "))
+                    and _RE_BLOCK_OPENER.match(t)):
+                stack.append(i)
+            elif t == "end" and stack:
+                ends[stack.pop()] = i
+        return ends
+
+    def _parse_block(self, lines: List[str], i: int, end: int, ends: Dict[int, int],
+                     stop_elif: bool = False, in_fn: bool = False) -> Tuple[List[Op], int]:
+        """Parse statements until `end` (or `elif`/`else:` when requested).
+
+        Returns the ops and the index of the terminating line; the caller
+        consumes the terminator.
+        """
+        ops: List[Op] = []
+        while i < end:
+            line = lines[i].strip()
+            if line == "end":
+                return ops, i
+            if stop_elif and (line == "else:" or _RE_ELIF.match(line)):
+                return ops, i
+            op, i = self._parse_stmt(lines, i, end, ends, in_fn)
+            # Fuse runs of constant sleeps into a single op.
+            if (op.__class__ is SleepOp and op.const is not _NOT_CONST
+                    and ops and ops[-1].__class__ is SleepOp
+                    and ops[-1].const is not _NOT_CONST):
+                total = float(ops[-1].const) + float(op.const)
+                ops[-1] = SleepOp(expr=repr(total), const=total)
+                continue
+            ops.append(op)
+        return ops, i
+
+    def _parse_stmt(self, lines: List[str], i: int, end: int,
+                    ends: Dict[int, int], in_fn: bool = False) -> Tuple[Op, int]:
+        line = lines[i].strip()
+
+        # if / elif / else
+        if _RE_IF.match(line):
+            return self._parse_if(lines, i, end, ends, in_fn)
+        if _RE_ELIF.match(line) or line == "else:":
+            raise RuntimeError("‘elif/else’ without matching ‘if’")
+
+        # loop (N):
+        m = _RE_LOOP_N.match(line)
+        if m:
+            body, j = self._parse_block(lines, i + 1, end, ends, in_fn=in_fn)
+            return LoopCountOp(count_expr=m.group(1), body=body), min(j + 1, end)
+        # loop arr:
+        m = _RE_LOOP_EACH.match(line)
+        if m:
+            body, j = self._parse_block(lines, i + 1, end, ends, in_fn=in_fn)
+            arr_name = m.group(1)
+            return LoopEachOp(arr_name=arr_name, body=body,
+                              needs_copy=self._body_rebinds(body, arr_name)), min(j + 1, end)
+
+        # fn name(args):
+        m = _RE_FN_BLOCK.match(line)
+        if m:
+            name, arglist = m.groups()
+            args = tuple(a.strip() for a in arglist.split(",") if a.strip())
+            j = ends.get(i, end)  # unterminated fn: body runs to the region's end
+            body, _ = self._parse_block(lines, i + 1, j, ends, in_fn=True)
+            return FnBlockOp(name=name, args=args, body=body), min(j + 1, end)
+
+        key = (line, in_fn)
+        op = self._line_cache.get(key)
+        if op is None:
+            op = self._parse_line(line, in_fn)
+            self._line_cache[key] = op
+        return op, i + 1
+
+    def _parse_line(self, line: str, in_fn: bool = False) -> Op:
+        """Parse a single non-block statement into its Op.
+
+        Ordered by how often each form appears in practice, with a cheap
+        prefix test in front of every parameterized regex so a line only
+        enters the regex engine for its own form. `out` and `return` have
+        no structure beyond the prefix and slice directly.
+        """
+        # out expr
+        if line.startswith("out "):
+            expr = line[4:].strip()
+            if expr:
+                return OutOp(expr=expr, const=_fold_const(expr))
+
+        # var NAME (expr)
+        if line.startswith("var "):
+            m = _RE_VAR.match(line)
+            if m:
+                return VarOp(name=m.group(1), expr=m.group(2),
+                             const=_fold_const(m.group(2)))
+
+        # mem[idx] = expr
+        if line.startswith("mem["):
+            m = _RE_MEM.match(line)
+            if m:
+                return MemSetOp(idx_expr=m.group(1), rhs_expr=m.group(2),
+                                idx_const=_fold_const(m.group(1)), rhs_const=_fold_const(m.group(2)))
+
+        # sleep(seconds)
+        if line.startswith("sleep("):
+            m = _RE_SLEEP.match(line)
+            if m:
+                return SleepOp(expr=m.group(1), const=_fold_const(m.group(1)))
+
+        # spawn (count) (list|RAN)
+        if line.startswith("spawn"):
+            m = _RE_SPAWN.match(line)
+            if m:
+                list_part = m.group(2)
+                if list_part.strip().upper() == "RAN":
+                    names = None
+                else:
+                    names = tuple(n.strip() for n in list_part.split(",") if n.strip())
+                return SpawnOp(count_expr=m.group(1), names=names)
+
+        # fn name(args) => expr
+        if line.startswith("fn "):
+            m = _RE_FN_EXPR.match(line)
+            if m:
+                name, arglist, expr = m.groups()
+                args = tuple(a.strip() for a in arglist.split(",") if a.strip())
+                return FnExprOp(name=name, args=args, expr=expr)
+
+        # return expr
+        if line.startswith("return "):
+            expr = line[7:].strip()
+            if expr:
+                if not in_fn:
+                    raise RuntimeError("‘return’ used outside of a function")
+                return ReturnOp(expr=expr)
+
+        # bare function calls
+        m = _RE_CALL.match(line)
+        if m:
+            arg_exprs = tuple(a.strip() for a in m.group(2).split(",")) if m.group(2).strip() else ()
+            return CallOp(name=m.group(1), arg_exprs=arg_exprs)
+
+        raise RuntimeError(f"Unrecognized syntax: {line}")
+
+    def _parse_if(self, lines: List[str], i: int, end: int,
+                  ends: Dict[int, int], in_fn: bool = False) -> Tuple[Op, int]:
+        branches: List[Tuple[str | None, List[Op]]] = []
+        while i < end:
+            hdr = lines[i].strip()
+            if hdr == "else:":
+                cond = None
+            else:
+                cond = hdr[hdr.find("(")+1: hdr.rfind(")")]
+            body, i = self._parse_block(lines, i + 1, end, ends, stop_elif=True, in_fn=in_fn)
+            branches.append((cond, body))
+            if i >= end or lines[i].strip() == "end":
+                return IfOp(branches=branches), min(i + 1, end)
+            # else the terminator is the next elif/else header; loop again
+
+        return IfOp(branches=branches), i
+
+    # ------------- Core executor -------------
+    def _exec_block(self, ops: List[Op]):
+        handlers = self._handlers
+        for op in ops:
+            handlers[op.code](op)
+
+    def _op_var(self, op: VarOp):
+        value = op.const if op.const is not _NOT_CONST else self._eval(op.expr)
+        self._scope_set(op.name, value)
+
+    def _op_mem_set(self, op: MemSetOp):
+        if op.idx_const is not _NOT_CONST:
+            idx = int(op.idx_const)
+        else:
+            idx = self._resolve_index(op.idx_expr)
+        rhs = op.rhs_const if op.rhs_const is not _NOT_CONST else self._eval(op.rhs_expr)
+        self._mem_set(idx, rhs)
+
+    def _resolve_index(self, idx_expr: str) -> int:
+        """Resolve a mem index, short-circuiting the common shapes.
+
+        Almost every index is an int literal or a bare variable name; both
+        resolve without entering the eval pipeline.
+        """
+        try:
+            return int(idx_expr)
+        except ValueError:
+            pass
+        v = self._scope_get(idx_expr.strip())
+        if v is not None:
+            return int(v)
+        return int(self._eval(idx_expr))
+
+    def _op_out(self, op: OutOp):
+        if op.const is not _NOT_CONST:
+            self.output(op.const)
+        else:
+            self.output(self._eval(op.expr))
+
+    def _op_sleep(self, op: SleepOp):
+        secs = op.const if op.const is not _NOT_CONST else self._eval(op.expr)
+        self._sleep(max(0.0, float(secs)))
+
+    # time.sleep granularity can be ~15 ms on some platforms; tiny waits
+    # spin on perf_counter instead so sleep(0.001) actually takes ~1 ms.
+    _SPIN_SLEEP_MAX = 2e-3
+
+    @staticmethod
+    def _sleep(secs: float):
+        if secs < LovelaceInterpreter._SPIN_SLEEP_MAX:
+            deadline = time.perf_counter() + secs
+            while time.perf_counter() < deadline:
+                pass
+        else:
+            time.sleep(secs)
+
+    def _op_fn_expr(self, op: FnExprOp):
+        self.funcs[op.name] = Function(args=op.args, expr=op.expr)
+
+    def _op_fn_block(self, op: FnBlockOp):
+        self.funcs[op.name] = Function(args=op.args, body=op.body)
+
+    def _op_call(self, op: CallOp):
+        self._call_func(op.name, op.arg_exprs)
+
+    def _op_return(self, op: ReturnOp):
+        raise _ReturnSignal(self._eval(op.expr))
+
+    # Above this count, spawn coalesces its report into one output call so
+    # big batches don't pay a sink flush per pick.
+    _SPAWN_BATCH = 64
+
+    def _handle_spawn(self, op: SpawnOp):
+        count = int(self._eval(op.count_expr))
+        pool = self.__apps if op.names is None else op.names
+        # One batched RNG call instead of count choice() round trips.
+        picks = self._rng.choices(pool, k=count) if pool else ["unknown"] * count
+        if count > self._SPAWN_BATCH:
+            self.output("\n".join(f"[spawn] {app} (simulated)" for app in picks))
+        else:
+            for app in picks:
+                self.output(f"[spawn] {app} (simulated)")
+
+    def _handle_if(self, op: IfOp):
+        for cond, body in op.branches:
+            if cond is None or bool(self._eval(cond)):
+                self._exec_block(body)
+                break
+
+    # Below this many iterations the interpreted loop wins; numba's import
+    # and compile cost would dominate.
+    _JIT_THRESHOLD = 10_000
+
+    def _handle_loop_count(self, op: LoopCountOp):
+        count = int(self._eval(op.count_expr))
+        if count >= self._JIT_THRESHOLD and self._try_jit_loop(op, count):
+            return
+        for _ in range(count):
+            self._exec_block(op.body)
+
+    # ------------- Numeric-loop JIT -------------
+    @staticmethod
+    def _numeric_kernel_source(op: LoopCountOp) -> Tuple[str, int] | None:
+        """Emit Python source for a loop body made only of numeric mem ops.
+
+        Returns (kernel_source, highest_mem_index), or None when any body op
+        falls outside the mem[int-literal] = <arithmetic> subset.
+        """
+        stmts = []
+        max_idx = -1
+        for b in op.body:
+            if b.__class__ is not MemSetOp:
+                return None
+            try:
+                idx = int(b.idx_expr.strip())
+            except ValueError:
+                return None
+            if idx < 0:
+                return None
+            max_idx = max(max_idx, idx)
+            rhs = b.rhs_expr.strip()
+            for ref in _RE_MEM_INT.findall(rhs):
+                max_idx = max(max_idx, int(ref))
+            if not _RE_NUMERIC_EXPR.match(_RE_MEM_INT.sub("", rhs)):
+                return None
+            stmts.append(f"        mem[{idx}] = {rhs}")
+        if not stmts:
+            return None
+        src = "def _kernel(mem, n):\n    for _ in range(n):\n" + "\n".join(stmts) + "\n"
+        return src, max_idx
+
+    def _compile_kernel(self, src: str):
+        try:
+            import numba
+            import numpy
+        except ImportError:
+            return False
+        self._np = numpy
+        try:
+            ns: Dict[str, Any] = {}
+            exec(compile(src, "<lovelace-jit>", "exec"), ns)
+            return numba.njit(cache=True)(ns["_kernel"])
+        except Exception:
+            return False
+
+    def _try_jit_loop(self, op: LoopCountOp, count: int) -> bool:
+        info = self._numeric_kernel_source(op)
+        if info is None:
+            return False
+        src, max_idx = info
+        kernel = self._jit_cache.get(src)
+        if kernel is None:
+            kernel = self._compile_kernel(src)
+            self._jit_cache[src] = kernel
+        if kernel is False:
+            return False
+        size = max(len(self._mem_list), max_idx + 1)
+        cells = self._mem_list + [0] * (size - len(self._mem_list))
+        # Cells parked in the sparse dict are part of the same address
+        # space: seed any that the kernel array covers, and retire them
+        # after write-back the way _mem_set does when the dense range
+        # grows over them — otherwise the zero padding shadows them.
+        for k, v in self._mem_sparse.items():
+            if 0 <= k < size:
+                cells[k] = v
+        if not all(type(v) in (int, float) for v in cells):
+            return False
+        np = self._np
+        # Lane selection must round-trip every cell's type exactly: int64
+        # when all cells are ints and the body provably stays within it,
+        # float64 only when every cell is already a float. A mixed pool
+        # would come back unified as floats where the interpreter keeps
+        # the int cells exact, so it runs interpreted instead.
+        if all(type(v) is int for v in cells):
+            if not self._int_kernel_safe(op.body, cells, count):
+                return False
+            dtype = np.int64
+        elif all(type(v) is float for v in cells):
+            dtype = np.float64
+        else:
+            return False
+        try:
+            arr = np.array(cells, dtype=dtype)
+        except (OverflowError, ValueError):
+            # Values the dtype can't represent, e.g. ints beyond int64.
+            # That's a property of the current cells, not the kernel, so
+            # leave the compiled kernel cached and run interpreted.
+            return False
+        try:
+            kernel(arr, count)
+        except Exception:
+            self._jit_cache[src] = False
+            return False
+        self._mem_list[:] = arr.tolist()
+        if self._mem_sparse:
+            for k in [k for k in self._mem_sparse if 0 <= k < size]:
+                del self._mem_sparse[k]
+        return True
+
+    @staticmethod
+    def _int_kernel_safe(body: List[Op], cells: List[Any], count: int) -> bool:
+        """Whether an int64 kernel provably cannot overflow on this run.
+
+        Python ints are unbounded, so a wrapped int64 would silently
+        diverge from the interpreter. The lane therefore only takes
+        self-referential additive updates — mem[i] = mem[i] ± literals —
+        whose growth per iteration is bounded by the sum of the body's
+        literal magnitudes; cross-cell or multiplicative bodies (fib-style
+        compounding) stay interpreted, as does any run whose bound
+        |start| + count * step could leave int64.
+        """
+        step = 0
+        for b in body:
+            refs = _RE_MEM_INT.findall(b.rhs_expr)
+            if refs and (len(refs) > 1 or int(refs[0]) != int(b.idx_expr)):
+                return False
+            rest = _RE_MEM_INT.sub("", b.rhs_expr)
+            if not _RE_INT_LANE_RHS.match(rest):
+                return False
+            step += sum(int(t) for t in re.findall(r"\d+", rest))
+        start = max((abs(v) for v in cells), default=0)
+        return start + count * step < 2 ** 63
+
+    @staticmethod
+    def _body_rebinds(ops: List[Op], name: str) -> bool:
+        """Whether executing ops could rebind `name` in the current scope.
+
+        Function calls are safe: their var writes land in the call's own
+        locals frame, never the caller's binding.
+        """
+        for op in ops:
+            cls = op.__class__
+            if cls is VarOp and op.name == name:
+                return True
+            if cls is LoopEachOp:
+                if name == "item" or LovelaceInterpreter._body_rebinds(op.body, name):
+                    return True
+            elif cls is LoopCountOp:
+                if LovelaceInterpreter._body_rebinds(op.body, name):
+                    return True
+            elif cls is IfOp:
+                for _, body in op.branches:
+                    if LovelaceInterpreter._body_rebinds(body, name):
+                        return True
+        return False
+
+    def _handle_loop_each(self, op: LoopEachOp):
+        arr = self._scope_get(op.arr_name, [])
+        scope = self._scopes[-1] if self._scopes else self.vars
+        had_item = "item" in scope
+        prev_item = scope.get("item")
+        for item in (list(arr) if op.needs_copy else arr):
+            scope["item"] = item
+            self._exec_block(op.body)
+        # Restore rather than pop, so a nested each-loop doesn't clobber the
+        # outer loop's item binding.
+        if had_item:
+            scope["item"] = prev_item
+        else:
+            scope.pop("item", None)
+
+    # ------------- Helpers -------------
+    # Keep the dense list for small non-negative indices (the common case)
+    # and spill anything else to the sparse dict.
+    _MEM_GROW_LIMIT = 1024
+
+    def _scope_set(self, name: str, value: Any):
+        (self._scopes[-1] if self._scopes else self.vars)[name] = value
+
+    def _scope_get(self, name: str, default: Any = None) -> Any:
+        if self._scopes:
+            top = self._scopes[-1]
+            if name in top:
+                return top[name]
+        return self.vars.get(name, default)
+
+    def _mem_get(self, idx: int) -> Any:
+        if type(idx) is not int:
+            idx = int(idx)
+        if 0 <= idx < len(self._mem_list):
+            return self._mem_list[idx]
+        return self._mem_sparse.get(idx, 0)
+
+    def _mem_set(self, idx: int, value: Any):
+        n = len(self._mem_list)
+        if 0 <= idx < n:
+            self._mem_list[idx] = value
+        elif 0 <= idx <= n + self._MEM_GROW_LIMIT:
+            self._mem_list.extend([0] * (idx + 1 - n))
+            # Migrate any sparse cells the new dense range now covers, so
+            # the zero-fill can't shadow an earlier out-of-range write.
+            if self._mem_sparse:
+                for k in [k for k in self._mem_sparse if n <= k <= idx]:
+                    self._mem_list[k] = self._mem_sparse.pop(k)
+            self._mem_list[idx] = value
+        else:
+            self._mem_sparse[idx] = value
+
+    def _eval(self, expr: str) -> Any:
+        # First, check if this is a bare Lovelace function call
+        m = _RE_CALL_EXPR.match(expr.strip())
+        if m:
+            fn_name, arglist = m.groups()
+            args = [a.strip() for a in arglist.split(",")] if arglist.strip() else []
+            if fn_name in self.funcs:
+                return self._call_func(fn_name, args)
+
+        expr_py = _inline_mem_reads(expr)
+
+        # vars doubles as the eval locals at top level, and inside a call
+        # the frame's pooled ChainMap is reused — nothing is allocated per
+        # evaluation either way.
+        if self._scope_envs:
+            env = self._scope_envs[-1]
+        else:
+            env = self.vars
+        try:
+            return eval(_compile_expr(expr_py), self._eval_globals, env)
+        except Exception:
+            return expr.strip('"')
+
+    def _call_func(self, name: str, arg_exprs: List[str]) -> Any:
+        if name not in self.funcs:
+            raise RuntimeError(f"Unknown function: {name}")
+        fn = self.funcs[name]
+        args_vals = [self._eval(a) for a in arg_exprs]
+
+        if fn.expr is not None:
+            # ChainMap pushes the argument frame in O(1); eval accepts any
+            # mapping as locals as long as globals is a real dict.
+            local = dict(zip(fn.args, args_vals))
+            expr_py = _inline_mem_reads(fn.expr)
+            return eval(_compile_expr(expr_py), self._eval_globals,
+                        ChainMap(local, self.vars))
+
+        local = dict(zip(fn.args, args_vals))
+        self._scopes.append(local)
+        self._scope_envs.append(ChainMap(local, self.vars))
+        try:
+            self._exec_block(fn.body or [])
+        except _ReturnSignal as ret:
+            return ret.value
+        finally:
+            self._scopes.pop()
+            self._scope_envs.pop()